@@ -13,6 +13,7 @@ to which each skill/ability/knowledge is required.
 import pandas as pd
 import numpy as np
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 # Paths
 RAW_DIR = os.path.expanduser("~/Downloads/capstone/data/raw/db_30_1_text")
@@ -23,7 +24,8 @@ os.makedirs(OUT_DIR, exist_ok=True)
 def load_onet_file(filename, category_label):
     """Load an O*NET data file and filter to Level (LV) scale."""
     path = os.path.join(RAW_DIR, filename)
-    df = pd.read_csv(path, sep="\t")
+    # LV scores are 0-7 with one decimal; float32 is ample and halves memory
+    df = pd.read_csv(path, sep="\t", dtype={"Data Value": "float32"})
 
     # Keep only the Level scale (LV) - measures degree of requirement
     df = df[df["Scale ID"] == "LV"].copy()
@@ -41,6 +43,34 @@ def load_onet_file(filename, category_label):
     return df
 
 
+def to_soc6(soc_codes):
+    """
+    Truncate detailed O*NET-SOC codes (e.g., 11-1011.03) to 6-digit SOC
+    (e.g., 11-1011) as a categorical.
+
+    Only the unique codes are sliced; rows are remapped by integer code.
+    """
+    cat = soc_codes.astype("category").cat
+    remap, soc6 = pd.factorize(cat.categories.str[:7])
+    codes = cat.codes.to_numpy()
+    return pd.Categorical.from_codes(
+        np.where(codes >= 0, remap[codes], -1), categories=soc6
+    )
+
+
+def top_k(values, labels, k):
+    """Return the k largest (label, value) pairs, largest first (ties keep
+    their original order, as with nlargest)."""
+    k = min(k, len(values))
+    kth = -np.partition(-values, k - 1)[k - 1]
+    # All values above the k-th, then the earliest ties at the k-th value
+    above = np.flatnonzero(values > kth)
+    ties = np.flatnonzero(values == kth)[:k - len(above)]
+    idx = np.concatenate([above, ties])
+    idx = idx[np.argsort(-values[idx], kind="stable")]
+    return [(labels[i], values[i]) for i in idx]
+
+
 def aggregate_to_6digit(df):
     """
     Aggregate detailed O*NET-SOC codes (e.g., 11-1011.03) to
@@ -48,12 +78,14 @@ def aggregate_to_6digit(df):
 
     This ensures compatibility with CPS occupation codes and
     AI exposure indices which typically use 6-digit SOC.
-    """
-    df = df.copy()
-    df["soc6"] = df["soc_code"].str[:7]  # e.g., "11-1011"
 
+    Expects categorical "soc6" and "dimension" columns so the groupby
+    runs on integer codes.
+    """
     # Average across detailed codes within same 6-digit SOC
-    df_agg = df.groupby(["soc6", "dimension"])["value"].mean().reset_index()
+    df_agg = df.groupby(
+        ["soc6", "dimension"], observed=True
+    )["value"].mean().reset_index()
 
     return df_agg
 
@@ -61,10 +93,15 @@ def aggregate_to_6digit(df):
 def main():
     print("Loading O*NET data files...")
 
-    # Load Skills, Abilities, Knowledge
-    skills = load_onet_file("Skills.txt", "Skill")
-    abilities = load_onet_file("Abilities.txt", "Ability")
-    knowledge = load_onet_file("Knowledge.txt", "Knowledge")
+    # Load Skills, Abilities, Knowledge concurrently
+    # (the pandas C parser releases the GIL, so threads are enough)
+    onet_files = [
+        ("Skills.txt", "Skill"),
+        ("Abilities.txt", "Ability"),
+        ("Knowledge.txt", "Knowledge"),
+    ]
+    with ThreadPoolExecutor(max_workers=len(onet_files)) as ex:
+        skills, abilities, knowledge = ex.map(lambda f: load_onet_file(*f), onet_files)
 
     print(f"  Skills: {skills.shape[0]} rows, {skills['dimension'].nunique()} dimensions")
     print(f"  Abilities: {abilities.shape[0]} rows, {abilities['dimension'].nunique()} dimensions")
@@ -76,18 +113,21 @@ def main():
     print(f"  Unique occupations (detailed): {combined['soc_code'].nunique()}")
     print(f"  Unique dimensions: {combined['dimension'].nunique()}")
 
+    # Categorical group keys: groupby/unstack then hash int codes, not strings
+    combined["soc6"] = to_soc6(combined["soc_code"])
+    combined["dimension"] = combined["dimension"].astype("category")
+
     # Aggregate to 6-digit SOC
     combined_6d = aggregate_to_6digit(combined)
     print(f"\nAfter 6-digit aggregation:")
     print(f"  Unique occupations: {combined_6d['soc6'].nunique()}")
 
     # Pivot to occupation x dimension matrix
-    skill_matrix = combined_6d.pivot_table(
-        index="soc6",
-        columns="dimension",
-        values="value",
-        aggfunc="mean"
-    )
+    # (soc6, dimension) pairs are already unique after aggregation
+    skill_matrix = combined_6d.set_index(["soc6", "dimension"])["value"].unstack()
+    # Plain string labels (Parquet can't store categorical column labels)
+    skill_matrix.index = skill_matrix.index.astype(str)
+    skill_matrix.columns = skill_matrix.columns.astype(str)
 
     # Handle missing values - fill with 0 (skill not relevant to occupation)
     n_missing = skill_matrix.isna().sum().sum()
@@ -96,43 +136,55 @@ def main():
     skill_matrix = skill_matrix.fillna(0)
 
     # Standardize each dimension to [0, 1] range for comparability
-    skill_matrix_norm = (skill_matrix - skill_matrix.min()) / (skill_matrix.max() - skill_matrix.min())
+    # (constant dimensions map to 0 instead of dividing by zero)
+    arr = skill_matrix.to_numpy(dtype=np.float32, copy=False)
+    mn = arr.min(axis=0)
+    rng = arr.max(axis=0) - mn
+    rng[rng == 0] = 1
+    skill_matrix_norm = pd.DataFrame(
+        (arr - mn) / rng, index=skill_matrix.index, columns=skill_matrix.columns
+    )
 
     print(f"\nFinal skill matrix shape: {skill_matrix_norm.shape}")
     print(f"  {skill_matrix_norm.shape[0]} occupations x {skill_matrix_norm.shape[1]} skill dimensions")
 
-    # Save both raw and normalized versions
-    skill_matrix.to_csv(os.path.join(OUT_DIR, "onet_skill_matrix_raw.csv"))
-    skill_matrix_norm.to_csv(os.path.join(OUT_DIR, "onet_skill_matrix_normalized.csv"))
+    # Save both raw and normalized versions (Parquet keeps float32 dtypes)
+    skill_matrix.to_parquet(
+        os.path.join(OUT_DIR, "onet_skill_matrix_raw.parquet"), compression="zstd"
+    )
+    skill_matrix_norm.to_parquet(
+        os.path.join(OUT_DIR, "onet_skill_matrix_normalized.parquet"), compression="zstd"
+    )
 
-    # Also save occupation list with titles
+    # Also save occupation list with titles (kept as CSV for inspection)
     occ_data = pd.read_csv(
         os.path.join(RAW_DIR, "Occupation Data.txt"), sep="\t"
     )
-    occ_data["soc6"] = occ_data["O*NET-SOC Code"].str[:7]
+    occ_data["soc6"] = to_soc6(occ_data["O*NET-SOC Code"])
     occ_titles = occ_data.drop_duplicates("soc6")[["soc6", "Title"]].copy()
     occ_titles.to_csv(os.path.join(OUT_DIR, "occupation_titles.csv"), index=False)
 
+    # Top-k summaries work on the underlying array
+    norm_arr = skill_matrix_norm.to_numpy()
+    dims = skill_matrix_norm.columns
+
     # Print sample
     print("\nSample occupations and top skills:")
-    for soc in skill_matrix_norm.index[:3]:
+    for i, soc in enumerate(skill_matrix_norm.index[:3]):
         title = occ_titles[occ_titles["soc6"] == soc]["Title"].values
         title_str = title[0] if len(title) > 0 else soc
-        top_skills = skill_matrix_norm.loc[soc].nlargest(5)
         print(f"\n  {soc} - {title_str}")
-        for dim, val in top_skills.items():
+        for dim, val in top_k(norm_arr[i], dims, 5):
             print(f"    {dim}: {val:.3f}")
 
     # Summary statistics
     print("\n--- Summary Statistics ---")
     print(f"Dimensions with highest average values across occupations:")
-    top_dims = skill_matrix_norm.mean().nlargest(10)
-    for dim, val in top_dims.items():
+    for dim, val in top_k(norm_arr.mean(axis=0), dims, 10):
         print(f"  {dim}: {val:.3f}")
 
     print(f"\nDimensions with most variation (std) across occupations:")
-    var_dims = skill_matrix_norm.std().nlargest(10)
-    for dim, val in var_dims.items():
+    for dim, val in top_k(norm_arr.std(axis=0, ddof=1), dims, 10):
         print(f"  {dim}: {val:.3f}")
 
     print(f"\nDone! Files saved to {OUT_DIR}")
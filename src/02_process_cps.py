@@ -21,10 +21,28 @@ os.makedirs(OUT_DIR, exist_ok=True)
 EMPLOYED_CODES = [10, 12]
 UNEMPLOYED_CODES = [21, 22]
 
+# Only the columns used below, with compact dtypes.
+# Group keys stay integer rather than category: integer groupbys only
+# build observed groups, and the keys are compared numerically below.
+# OCCLY/ASECWT are missing outside the ASEC supplement, so they stay float.
+# Weights stay float64 so the large weighted sums don't lose precision.
+CPS_DTYPES = {
+    "YEAR": "int16",
+    "MONTH": "int8",
+    "EMPSTAT": "int8",
+    "OCC2010": "int32",
+    "OCCLY": "float32",
+    "ASECWT": "float64",
+    "WTFINL": "float64",
+}
+
 
 def main():
     print("Loading CPS data...")
-    df = pd.read_csv(RAW_PATH)
+    df = pd.read_csv(
+        RAW_PATH, engine="pyarrow",
+        usecols=list(CPS_DTYPES), dtype=CPS_DTYPES
+    )
     print(f"  Loaded {len(df):,} rows, {df.YEAR.min()}-{df.YEAR.max()}")
 
     # =========================================================
@@ -33,15 +51,20 @@ def main():
     print("\n--- Building Switching Matrix ---")
 
     # Filter to observations with valid current and prior-year occupation
-    has_switch = df["OCCLY"].notna() & (df["OCC2010"] != 9999) & (df["OCCLY"] != 9999)
-    switch_df = df[has_switch].copy()
+    # IPUMS OCCLY: 0 = NIU, 9999 = missing
+    has_switch = (
+        df["OCCLY"].notna()
+        & ~df["OCCLY"].isin([0, 9999])
+        & ~df["OCC2010"].isin([0, 9999])
+    )
 
     # Also need to be employed in current period
-    switch_df = switch_df[switch_df["EMPSTAT"].isin(EMPLOYED_CODES)].copy()
+    is_employed = df["EMPSTAT"].isin(EMPLOYED_CODES)
 
-    # OCCLY values: need to check for NIU codes
-    # IPUMS OCCLY: 0 = NIU, 9999 = missing
-    switch_df = switch_df[(switch_df["OCCLY"] != 0) & (switch_df["OCC2010"] != 0)].copy()
+    # One combined mask and only the columns used below -> a single small copy
+    switch_df = df.loc[
+        has_switch & is_employed, ["YEAR", "OCCLY", "OCC2010", "ASECWT"]
+    ].copy()
 
     print(f"  Valid switching observations: {len(switch_df):,}")
     print(f"  Year range: {switch_df.YEAR.min()}-{switch_df.YEAR.max()}")
@@ -55,17 +78,21 @@ def main():
 
     # Build directional switching matrix using ASEC weights
     # OCCLY is only in ASEC supplement, which uses ASECWT (not WTFINL)
-    switch_only = switch_df[switch_df["is_switch"]].copy()
-
-    switching_matrix = switch_only.groupby(
-        ["OCCLY", "OCC2010"]
+    # One pass over the ASEC subset covers both switchers and stayers
+    pair_weights = switch_df.groupby(
+        ["OCCLY", "OCC2010", "is_switch"], observed=True
     )["ASECWT"].sum().reset_index()
+
+    switching_matrix = pair_weights.loc[
+        pair_weights["is_switch"], ["OCCLY", "OCC2010", "ASECWT"]
+    ].reset_index(drop=True)
     switching_matrix.columns = ["occ_origin", "occ_dest", "weighted_switches"]
 
     # Also compute stayer counts by occupation (for denominator)
-    stayer_counts = switch_df[~switch_df["is_switch"]].groupby(
-        "OCC2010"
-    )["ASECWT"].sum().reset_index()
+    # Stayers have OCCLY == OCC2010, so there is one row per occupation
+    stayer_counts = pair_weights.loc[
+        ~pair_weights["is_switch"], ["OCC2010", "ASECWT"]
+    ].reset_index(drop=True)
     stayer_counts.columns = ["occ", "weighted_stayers"]
 
     print(f"  Unique origin occupations: {switching_matrix['occ_origin'].nunique()}")
@@ -73,11 +100,11 @@ def main():
     print(f"  Unique directional pairs with >0 switches: {len(switching_matrix):,}")
 
     # Save
-    switching_matrix.to_csv(
-        os.path.join(OUT_DIR, "cps_switching_matrix.csv"), index=False
+    switching_matrix.to_parquet(
+        os.path.join(OUT_DIR, "cps_switching_matrix.parquet"), index=False, compression="zstd"
     )
-    stayer_counts.to_csv(
-        os.path.join(OUT_DIR, "cps_stayer_counts.csv"), index=False
+    stayer_counts.to_parquet(
+        os.path.join(OUT_DIR, "cps_stayer_counts.parquet"), index=False, compression="zstd"
     )
 
     # =========================================================
@@ -86,17 +113,17 @@ def main():
     print("\n--- Building Annual Employment Counts ---")
 
     # Use full CPS sample (not just ASEC) for employment counts
-    employed = df[
-        (df["EMPSTAT"].isin(EMPLOYED_CODES)) & (df["OCC2010"] != 9999)
-    ].copy()
+    employed = df.loc[
+        is_employed & (df["OCC2010"] != 9999), ["YEAR", "OCC2010", "WTFINL"]
+    ]
 
     annual_emp = employed.groupby(
-        ["YEAR", "OCC2010"]
+        ["YEAR", "OCC2010"], observed=True
     )["WTFINL"].sum().reset_index()
     annual_emp.columns = ["year", "occ", "weighted_employment"]
 
     # Normalize: divide by number of months in each year (since monthly CPS)
-    months_per_year = df.groupby("YEAR")["MONTH"].nunique().to_dict()
+    months_per_year = df.groupby("YEAR", observed=True)["MONTH"].nunique().to_dict()
     annual_emp["n_months"] = annual_emp["year"].map(months_per_year)
     annual_emp["avg_monthly_employment"] = (
         annual_emp["weighted_employment"] / annual_emp["n_months"]
@@ -105,8 +132,8 @@ def main():
     print(f"  Occupation-year observations: {len(annual_emp):,}")
     print(f"  Unique occupations: {annual_emp['occ'].nunique()}")
 
-    annual_emp.to_csv(
-        os.path.join(OUT_DIR, "cps_annual_employment.csv"), index=False
+    annual_emp.to_parquet(
+        os.path.join(OUT_DIR, "cps_annual_employment.parquet"), index=False, compression="zstd"
     )
 
     # =========================================================
@@ -116,29 +143,27 @@ def main():
 
     # Pre period: 2018-2021 average (exclude 2020 COVID distortion? keep for now)
     # Post period: 2023-2025
-    pre = annual_emp[annual_emp["year"].between(2018, 2021)].groupby("occ")[
-        "avg_monthly_employment"
-    ].mean().reset_index()
-    pre.columns = ["occ", "emp_pre"]
-
-    post = annual_emp[annual_emp["year"].between(2023, 2025)].groupby("occ")[
-        "avg_monthly_employment"
-    ].mean().reset_index()
-    post.columns = ["occ", "emp_post"]
-
-    changes = pre.merge(post, on="occ", how="inner")
-    changes["emp_change"] = changes["emp_post"] - changes["emp_pre"]
-    changes["emp_pct_change"] = (
+    # Also compute pre without 2020 (COVID year)
+    # The periods overlap, so mask employment per period and average all
+    # three in a single groupby (mean skips the masked NaNs)
+    emp = annual_emp["avg_monthly_employment"]
+    year = annual_emp["year"]
+    periods = pd.DataFrame({
+        "occ": annual_emp["occ"],
+        "emp_pre": emp.where(year.between(2018, 2021)),
+        "emp_post": emp.where(year.between(2023, 2025)),
+        "emp_pre_no_covid": emp.where(year.isin([2018, 2019, 2021])),
+    })
+    period_means = periods.groupby("occ", observed=True).mean()
+
+    # Keep occupations observed in both pre and post periods
+    changes = period_means.dropna(
+        subset=["emp_pre", "emp_post"]
+    ).reset_index()[["occ", "emp_pre", "emp_post", "emp_pre_no_covid"]]
+    changes.insert(3, "emp_change", changes["emp_post"] - changes["emp_pre"])
+    changes.insert(4, "emp_pct_change", (
         (changes["emp_post"] - changes["emp_pre"]) / changes["emp_pre"] * 100
-    )
-
-    # Also compute without 2020 (COVID year)
-    pre_no_covid = annual_emp[
-        annual_emp["year"].isin([2018, 2019, 2021])
-    ].groupby("occ")["avg_monthly_employment"].mean().reset_index()
-    pre_no_covid.columns = ["occ", "emp_pre_no_covid"]
-
-    changes = changes.merge(pre_no_covid, on="occ", how="left")
+    ))
     changes["emp_pct_change_no_covid"] = (
         (changes["emp_post"] - changes["emp_pre_no_covid"])
         / changes["emp_pre_no_covid"] * 100
@@ -161,24 +186,24 @@ def main():
     for _, row in changes.nlargest(10, "emp_pct_change_no_covid").iterrows():
         print(f"    OCC {int(row['occ']):>4d}: {row['emp_pct_change_no_covid']:+.1f}%")
 
-    changes.to_csv(
-        os.path.join(OUT_DIR, "cps_employment_changes.csv"), index=False
+    changes.to_parquet(
+        os.path.join(OUT_DIR, "cps_employment_changes.parquet"), index=False, compression="zstd"
     )
 
     # =========================================================
     # 4. SUMMARY STATISTICS
     # =========================================================
     print("\n--- Overall Summary ---")
-    total_emp_by_year = annual_emp.groupby("year")["avg_monthly_employment"].sum()
+    total_emp_by_year = annual_emp.groupby("year", observed=True)["avg_monthly_employment"].sum()
     print("  Total weighted employment by year:")
     for year, emp in total_emp_by_year.items():
         print(f"    {year}: {emp/1e6:.1f}M")
 
     print(f"\nDone! Files saved to {OUT_DIR}")
-    print("  - cps_switching_matrix.csv")
-    print("  - cps_stayer_counts.csv")
-    print("  - cps_annual_employment.csv")
-    print("  - cps_employment_changes.csv")
+    print("  - cps_switching_matrix.parquet")
+    print("  - cps_stayer_counts.parquet")
+    print("  - cps_annual_employment.parquet")
+    print("  - cps_employment_changes.parquet")
 
 
 if __name__ == "__main__":
@@ -12,51 +12,82 @@ Strategy:
 import pandas as pd
 import numpy as np
 import os
-from difflib import SequenceMatcher
+from collections import defaultdict
+from rapidfuzz import fuzz, process, utils
 
 DATA_DIR = os.path.expanduser("~/Downloads/capstone/data")
 RAW_DIR = os.path.join(DATA_DIR, "raw")
 PROC_DIR = os.path.join(DATA_DIR, "processed")
 
+# Minimum title similarity (0-100) for the title-matching fallback
+TITLE_MATCH_THRESHOLD = 60
 
-def format_soc(code):
-    """Convert '111011' or '1110XX' to '11-1011' or '11-10XX' format."""
-    code = str(code).strip().replace("-", "").replace(" ", "")
-    if len(code) >= 6:
-        return f"{code[:2]}-{code[2:6]}"
-    return code
+
+def format_soc_series(codes):
+    """Convert a Series of '111011' or '1110XX' to '11-1011' or '11-10XX' format."""
+    codes = (
+        codes.astype(str).str.strip()
+        .str.replace("-", "", regex=False)
+        .str.replace(" ", "", regex=False)
+    )
+    return codes.where(codes.str.len() < 6, codes.str[:2] + "-" + codes.str[2:6])
+
+
+def build_onet_index(onet_socs):
+    """
+    Index O*NET SOC codes by their dash-stripped digits and by every
+    digit prefix, so SOC lookups are hash lookups instead of scans.
+    """
+    onet_digits = {s.replace("-", ""): s for s in onet_socs}
+    prefix_index = {k: defaultdict(set) for k in range(1, 7)}
+    for d, s in onet_digits.items():
+        for k in prefix_index:
+            if len(d) >= k:
+                prefix_index[k][d[:k]].add(s)
+    return onet_digits, prefix_index
 
 
-def find_onet_matches(soc_str, onet_socs):
+def find_onet_matches(soc_str, onet_index):
     """Find O*NET codes matching a SOC code (handling XX wildcards)."""
-    soc_str = str(soc_str).strip()
+    onet_digits, prefix_index = onet_index
+    soc_str = str(soc_str).strip().upper()
+    digits = soc_str.replace("-", "")
 
     # Direct match
-    if soc_str in onet_socs:
-        return [soc_str]
+    if digits in onet_digits:
+        return [onet_digits[digits]]
 
     # Wildcard match: XX at end means broad group
-    if "X" in soc_str.upper():
-        prefix = soc_str.upper().split("X")[0]
+    if "X" in soc_str:
+        prefix = soc_str.split("X")[0]
         if len(prefix) >= 4:
-            matches = [s for s in onet_socs if s.replace("-", "").startswith(prefix.replace("-", ""))]
+            prefix = prefix.replace("-", "")
+            matches = prefix_index.get(len(prefix), {}).get(prefix)
             if matches:
-                return matches
+                return list(matches)
 
     # Prefix match (first 5 chars of SOC)
-    prefix5 = soc_str.replace("-", "")[:5]
-    matches = [s for s in onet_socs if s.replace("-", "").startswith(prefix5)]
+    prefix5 = digits[:5]
+    matches = prefix_index.get(len(prefix5), {}).get(prefix5)
     if matches:
-        return matches
+        return list(matches)
 
     return []
 
 
-def title_similarity(title1, title2):
-    """Compute similarity between two occupation titles."""
-    t1 = title1.lower().strip()
-    t2 = title2.lower().strip()
-    return SequenceMatcher(None, t1, t2).ratio()
+def map_to_onet(xw, occ_col, soc_col, onet_index):
+    """
+    Map occupation codes in a crosswalk to the set of matching O*NET SOCs.
+    Each unique SOC string is looked up once; rows are joined back on SOC.
+    """
+    uniq = pd.Series(xw[soc_col].unique())
+    match_df = pd.DataFrame({
+        soc_col: uniq,
+        "soc6_onet": uniq.map(lambda s: find_onet_matches(s, onet_index)),
+    }).explode("soc6_onet").dropna()
+
+    long = xw[[occ_col, soc_col]].merge(match_df, on=soc_col)
+    return long.groupby(occ_col)["soc6_onet"].agg(set).to_dict()
 
 
 def main():
@@ -65,13 +96,16 @@ def main():
     print("=" * 60)
 
     # Load O*NET data
-    onet = pd.read_csv(os.path.join(PROC_DIR, "onet_skill_matrix_normalized.csv"), index_col=0)
+    onet = pd.read_parquet(os.path.join(PROC_DIR, "onet_skill_matrix_normalized.parquet"))
     onet_socs = set(onet.index)
+    onet_index = build_onet_index(onet_socs)
     onet_titles = pd.read_csv(os.path.join(PROC_DIR, "occupation_titles.csv"))
     onet_title_map = dict(zip(onet_titles["soc6"], onet_titles["Title"]))
 
     # Load CPS employment data to know which OCC2010 codes we need
-    cps_emp = pd.read_csv(os.path.join(PROC_DIR, "cps_employment_changes.csv"))
+    cps_emp = pd.read_parquet(
+        os.path.join(PROC_DIR, "cps_employment_changes.parquet"), columns=["occ", "emp_pre"]
+    )
     cps_occs = set(cps_emp["occ"].astype(int).unique())
 
     # Load OCC2010 titles from IPUMS crosswalk
@@ -99,16 +133,8 @@ def main():
     census_xw["soc_2018_fmt"] = census_xw["soc_2018"].astype(str).str.strip()
 
     # Map census codes to O*NET
-    mapping = {}  # occ2010 -> set of onet SOC codes
-
-    for _, row in census_xw.iterrows():
-        occ = row["census_2010"]
-        soc = row["soc_2018_fmt"]
-        matches = find_onet_matches(soc, onet_socs)
-        if matches:
-            if occ not in mapping:
-                mapping[occ] = set()
-            mapping[occ].update(matches)
+    # occ2010 -> set of onet SOC codes
+    mapping = map_to_onet(census_xw, "census_2010", "soc_2018_fmt", onet_index)
 
     matched_1 = cps_occs & set(mapping.keys())
     print(f"  Matched {len(matched_1)}/{len(cps_occs)} CPS occupations")
@@ -127,21 +153,21 @@ def main():
         ("2018 ACS/PRCS OCC code", "2018 Onward ACS/PRCS"),
     ]
 
-    for occ_col, soc_col in vintage_pairs:
-        sub = ipums_xw[[occ_col, soc_col]].dropna()
-        sub.columns = ["occ", "occsoc"]
-        sub["occ"] = pd.to_numeric(sub["occ"], errors="coerce")
-        sub = sub[sub["occ"].notna() & (sub["occ"] > 0)]
-        sub["occ"] = sub["occ"].astype(int)
-
-        for _, row in sub.iterrows():
-            occ = row["occ"]
-            soc = format_soc(row["occsoc"])
-            matches = find_onet_matches(soc, onet_socs)
-            if matches and occ not in mapping:
-                mapping[occ] = set()
-            if matches:
-                mapping[occ].update(matches)
+    # Stack the vintages into one (occ, occsoc) frame and clean it once
+    pairs_df = pd.concat(
+        [ipums_xw[[occ_col, soc_col]].set_axis(["occ", "occsoc"], axis=1)
+         for occ_col, soc_col in vintage_pairs],
+        ignore_index=True
+    ).dropna()
+    pairs_df["occ"] = pd.to_numeric(pairs_df["occ"], errors="coerce")
+    pairs_df = pairs_df[pairs_df["occ"] > 0]  # also drops NaN
+    pairs_df["occ"] = pairs_df["occ"].astype(int)
+    pairs_df["soc_fmt"] = format_soc_series(pairs_df["occsoc"])
+    pairs_df = pairs_df.drop_duplicates(["occ", "soc_fmt"])
+
+    ipums_mapping = map_to_onet(pairs_df, "occ", "soc_fmt", onet_index)
+    for occ, socs in ipums_mapping.items():
+        mapping.setdefault(occ, set()).update(socs)
 
     matched_2 = cps_occs & set(mapping.keys())
     print(f"  Matched {len(matched_2)}/{len(cps_occs)} CPS occupations (cumulative)")
@@ -150,26 +176,30 @@ def main():
     print("\n[3] Title-based matching for remaining...")
     still_unmatched = cps_occs - set(mapping.keys())
 
-    onet_title_list = [(soc, title) for soc, title in onet_title_map.items()]
+    onet_title_socs = np.array(list(onet_title_map.keys()))
+    # Normalize titles once (lowercase, strip punctuation/whitespace)
+    onet_title_norm = [utils.default_process(t) for t in onet_title_map.values()]
+    unmatched_with_title = sorted(
+        occ for occ in still_unmatched if occ in occ2010_title_map
+    )
 
-    for occ in still_unmatched:
-        if occ not in occ2010_title_map:
-            continue
-        cps_title = occ2010_title_map[occ]
+    if unmatched_with_title:
+        cps_title_norm = [
+            utils.default_process(occ2010_title_map[occ]) for occ in unmatched_with_title
+        ]
 
-        # Find best matching O*NET title
-        best_score = 0
-        best_matches = []
-        for soc, onet_title in onet_title_list:
-            score = title_similarity(cps_title, onet_title)
-            if score > best_score:
-                best_score = score
-                best_matches = [soc]
-            elif score == best_score:
-                best_matches.append(soc)
+        # Similarity of every CPS title to every O*NET title (0-100).
+        # score_cutoff lets rapidfuzz abandon hopeless pairs early (scored 0)
+        scores = process.cdist(
+            cps_title_norm, onet_title_norm, scorer=fuzz.ratio,
+            score_cutoff=TITLE_MATCH_THRESHOLD, workers=-1
+        )
+        best_scores = scores.max(axis=1, keepdims=True)
+        is_best = scores == best_scores
 
-        if best_score >= 0.6:  # Threshold for acceptable match
-            mapping[occ] = set(best_matches)
+        # Keep all tied best matches above the acceptance threshold
+        for i in np.flatnonzero(best_scores[:, 0] >= TITLE_MATCH_THRESHOLD):
+            mapping[unmatched_with_title[i]] = set(onet_title_socs[is_best[i]].tolist())
 
     matched_3 = cps_occs & set(mapping.keys())
     print(f"  Matched {len(matched_3)}/{len(cps_occs)} CPS occupations (cumulative)")
@@ -185,18 +215,22 @@ def main():
     # ---- Build final skill matrix ----
     print("\n[4] Building skill matrix by OCC2010...")
 
-    occ2010_skills = {}
-    occ2010_titles = {}
-
-    for occ, soc_set in mapping.items():
-        soc_list = list(soc_set)
-        matching = onet.loc[onet.index.isin(soc_list)]
-        if len(matching) > 0:
-            occ2010_skills[occ] = matching.mean()
-            occ2010_titles[occ] = occ2010_title_map.get(occ, f"OCC {occ}")
+    # Crosswalk in long form: one row per (OCC2010, O*NET SOC) pair
+    xw_df = (
+        pd.Series(mapping, name="soc6_onet")
+        .rename_axis("occ2010")
+        .map(sorted)
+        .explode()
+        .reset_index()
+    )
 
-    skill_matrix = pd.DataFrame(occ2010_skills).T
-    skill_matrix.index.name = "occ2010"
+    # Average O*NET skill vectors over each occupation's matched SOCs
+    skill_matrix = (
+        xw_df.merge(onet, left_on="soc6_onet", right_index=True)
+        .drop(columns="soc6_onet")
+        .groupby("occ2010")
+        .mean()
+    )
     skill_matrix.index = skill_matrix.index.astype(int)
 
     # Final coverage check
@@ -209,21 +243,21 @@ def main():
     print(f"  Employment coverage: {100*emp_coverage:.1f}%")
 
     # Save
-    skill_matrix.to_csv(os.path.join(PROC_DIR, "skill_matrix_by_occ2010.csv"))
+    skill_matrix.to_parquet(
+        os.path.join(PROC_DIR, "skill_matrix_by_occ2010.parquet"), compression="zstd"
+    )
 
     titles_df = pd.DataFrame({
-        "occ2010": list(occ2010_titles.keys()),
-        "title": list(occ2010_titles.values())
+        "occ2010": skill_matrix.index,
+        "title": [occ2010_title_map.get(occ, f"OCC {occ}") for occ in skill_matrix.index]
     })
     titles_df.to_csv(os.path.join(PROC_DIR, "occ2010_titles.csv"), index=False)
 
     # Save crosswalk
-    xw_rows = []
-    for occ, soc_set in mapping.items():
-        for soc in soc_set:
-            xw_rows.append({"occ2010": occ, "soc6_onet": soc})
-    xw_df = pd.DataFrame(xw_rows)
-    xw_df.to_csv(os.path.join(PROC_DIR, "crosswalk_occ2010_to_onet_soc.csv"), index=False)
+    xw_df.to_parquet(
+        os.path.join(PROC_DIR, "crosswalk_occ2010_to_onet_soc.parquet"),
+        index=False, compression="zstd"
+    )
 
     print(f"\nDone! Saved to {PROC_DIR}")
 
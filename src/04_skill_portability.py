@@ -13,8 +13,14 @@ Output: directional pairwise skill portability matrix + aggregated occupation-le
 
 import pandas as pd
 import numpy as np
+import numba as nb
+import argparse
 import os
-from sklearn.ensemble import RandomForestRegressor
+from scipy.sparse import coo_matrix, hstack
+from scipy.sparse.linalg import lsmr
+from sklearn.base import clone
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.inspection import permutation_importance
 from sklearn.model_selection import cross_val_score
 import warnings
 warnings.filterwarnings("ignore")
@@ -34,8 +40,8 @@ def build_switching_regression_data():
     print("Building switching regression data...")
 
     # Load switching matrix and stayer counts
-    switches = pd.read_csv(os.path.join(PROC_DIR, "cps_switching_matrix.csv"))
-    stayers = pd.read_csv(os.path.join(PROC_DIR, "cps_stayer_counts.csv"))
+    switches = pd.read_parquet(os.path.join(PROC_DIR, "cps_switching_matrix.parquet"))
+    stayers = pd.read_parquet(os.path.join(PROC_DIR, "cps_stayer_counts.parquet"))
 
     # Ensure integer occupation codes for matching
     switches["occ_origin"] = switches["occ_origin"].astype(int)
@@ -43,16 +49,23 @@ def build_switching_regression_data():
     stayers["occ"] = stayers["occ"].astype(int)
 
     # Load skill matrix
-    skills = pd.read_csv(os.path.join(PROC_DIR, "skill_matrix_by_occ2010.csv"), index_col=0)
+    skills = pd.read_parquet(os.path.join(PROC_DIR, "skill_matrix_by_occ2010.parquet"))
     skills.index = skills.index.astype(int)
     skill_occs = set(skills.index)
 
+    # Dense float32 skill array + OCC2010 code -> row lookup table,
+    # so pair features can be gathered with plain integer indexing
+    skills_np = skills.to_numpy(dtype=np.float32)
+    occ_lookup = np.full(skills.index.max() + 1, -1, dtype=np.int32)
+    occ_lookup[skills.index.to_numpy()] = np.arange(len(skills))
+
     # Filter to occupations with skill data
+    # (no copies needed: the merge below builds a new frame)
     switches = switches[
         switches["occ_origin"].isin(skill_occs) &
         switches["occ_dest"].isin(skill_occs)
-    ].copy()
-    stayers = stayers[stayers["occ"].isin(skill_occs)].copy()
+    ]
+    stayers = stayers[stayers["occ"].isin(skill_occs)]
 
     # Merge stayer counts as denominator
     switches = switches.merge(
@@ -70,54 +83,126 @@ def build_switching_regression_data():
     switches["log_switch_share"] = np.log(switches["switch_share"])
 
     # Remove self-pairs and infinite values
-    switches = switches[switches["occ_origin"] != switches["occ_dest"]].copy()
-    switches = switches[np.isfinite(switches["log_switch_share"])].copy()
+    # (one copy here; later steps add their columns to it in place)
+    switches = switches[
+        (switches["occ_origin"] != switches["occ_dest"]) &
+        np.isfinite(switches["log_switch_share"])
+    ].copy()
 
     print(f"  Directional pairs: {len(switches):,}")
     print(f"  Unique origins: {switches['occ_origin'].nunique()}")
     print(f"  Unique destinations: {switches['occ_dest'].nunique()}")
     print(f"  Log switch share range: [{switches['log_switch_share'].min():.2f}, {switches['log_switch_share'].max():.2f}]")
 
-    return switches, skills
+    return switches, skills, skills_np, occ_lookup
+
+
+@nb.njit(parallel=True, cache=True)
+def _fe_sweep(x, out, codes_o, codes_d, cnt_o, cnt_d, sum_o, sum_d):
+    """One alternating-projection sweep: out = x demeaned by origin, then destination."""
+    N = x.shape[0]
+
+    # Demean by origin (serial scatter-add, parallel subtract)
+    sum_o[:] = 0.0
+    for i in range(N):
+        sum_o[codes_o[i]] += x[i]
+    for i in nb.prange(N):
+        out[i] = x[i] - sum_o[codes_o[i]] / cnt_o[codes_o[i]]
+
+    # Demean by destination
+    sum_d[:] = 0.0
+    for i in range(N):
+        sum_d[codes_d[i]] += out[i]
+    for i in nb.prange(N):
+        out[i] -= sum_d[codes_d[i]] / cnt_d[codes_d[i]]
+
+
+@nb.njit(parallel=True, cache=True)
+def demean_two_way(y, codes_o, codes_d, cnt_o, cnt_d, tol, maxiter, acceleration_freq=3):
+    """
+    Two-way fixed-effects demeaning by alternating projections.
+    Repeatedly subtracts origin means then destination means from y
+    (codes are 0-based group indices, cnt_* the group sizes) until the
+    largest per-iteration change is below tol. Every acceleration_freq-th
+    iteration applies Irons-Tuck extrapolation (0 disables it).
+    Returns (residuals, converged).
+    """
+    N = y.shape[0]
+    sum_o = np.zeros(cnt_o.shape[0])
+    sum_d = np.zeros(cnt_d.shape[0])
+    x = y.copy()
+    gx = np.empty(N)
+    ggx = np.empty(N)
+    for it in range(maxiter):
+        _fe_sweep(x, gx, codes_o, codes_d, cnt_o, cnt_d, sum_o, sum_d)
+
+        max_diff = 0.0
+        if acceleration_freq > 0 and (it + 1) % acceleration_freq == 0:
+            # Irons-Tuck: apply the sweep twice and extrapolate
+            _fe_sweep(gx, ggx, codes_o, codes_d, cnt_o, cnt_d, sum_o, sum_d)
+            vprod = 0.0
+            ssq = 0.0
+            for i in nb.prange(N):
+                delta_gx = ggx[i] - gx[i]
+                delta2_x = delta_gx - gx[i] + x[i]
+                vprod += delta_gx * delta2_x
+                ssq += delta2_x * delta2_x
+            coef = vprod / ssq if ssq > 1e-300 else 0.0
+            for i in nb.prange(N):
+                x_new = ggx[i] - coef * (ggx[i] - gx[i])
+                max_diff = max(max_diff, abs(x_new - x[i]))
+                x[i] = x_new
+        else:
+            for i in nb.prange(N):
+                max_diff = max(max_diff, abs(gx[i] - x[i]))
+                x[i] = gx[i]
+
+        # Check convergence
+        if max_diff < tol:
+            return x, True
+
+    return x, False
 
 
-def step1_ols_residualize(switches):
+def step1_ols_residualize(switches, method="lsmr"):
     """
     Step 1: OLS regression of log switching shares on occupation fixed effects.
     ln(s_{o,o'}/s_{o,o}) = alpha_o + lambda_{o'} + epsilon_{o,o'}
 
-    Uses demeaning approach for efficiency with many FE.
+    method="lsmr" solves least squares on a sparse origin + destination
+    dummy matrix; method="map" uses iterative demeaning instead.
     """
     print("\nStep 1: OLS residualization on occupation FE...")
 
-    y = switches["log_switch_share"].values
-
-    # Create origin and destination fixed effects using dummies
-    # For efficiency, demean by origin and destination
-    origin_means = switches.groupby("occ_origin")["log_switch_share"].transform("mean")
-    dest_means = switches.groupby("occ_dest")["log_switch_share"].transform("mean")
-    grand_mean = y.mean()
-
-    # Two-way FE approximation via iterative demeaning
-    residuals = y.copy()
-    for _ in range(50):  # Iterate to convergence
-        residuals_old = residuals.copy()
-        # Demean by origin
-        origin_resid_means = pd.Series(residuals, index=switches.index).groupby(
-            switches["occ_origin"]
-        ).transform("mean")
-        residuals = residuals - origin_resid_means.values
-        # Demean by destination
-        dest_resid_means = pd.Series(residuals, index=switches.index).groupby(
-            switches["occ_dest"]
-        ).transform("mean")
-        residuals = residuals - dest_resid_means.values
+    y = switches["log_switch_share"].to_numpy(dtype=np.float64)
+
+    # Integer group codes for origin and destination FE (factorized once)
+    codes_o, uniq_o = pd.factorize(switches["occ_origin"])
+    codes_d, uniq_d = pd.factorize(switches["occ_dest"])
+
+    if method == "map":
+        # Two-way FE via iterative demeaning (compiled kernel);
+        # group sizes are fixed, so count them once up front
+        cnt_o = np.bincount(codes_o, minlength=len(uniq_o)).astype(np.float64)
+        cnt_d = np.bincount(codes_d, minlength=len(uniq_d)).astype(np.float64)
+        residuals, converged = demean_two_way(
+            y, codes_o, codes_d, cnt_o, cnt_d, 1e-10, 50
+        )
+        if not converged:
+            print("  Warning: FE demeaning did not converge in 50 iterations")
+    else:
+        # Two-way FE via sparse least squares on the dummy matrix
+        N = len(y)
+        rows = np.arange(N)
+        D = hstack([
+            coo_matrix((np.ones(N), (rows, codes_o)), shape=(N, len(uniq_o))),
+            coo_matrix((np.ones(N), (rows, codes_d)), shape=(N, len(uniq_d))),
+        ]).tocsr()
+        sol = lsmr(D, y, atol=1e-10, btol=1e-10)
+        if sol[1] not in (0, 1, 2):
+            print(f"  Warning: LSMR stopped early (istop={sol[1]}, {sol[2]} iterations)")
+        residuals = y - D @ sol[0]
 
-        # Check convergence
-        if np.max(np.abs(residuals - residuals_old)) < 1e-10:
-            break
-
-    switches = switches.copy()
     switches["residual"] = residuals
 
     # R-squared of FE model
@@ -131,14 +216,25 @@ def step1_ols_residualize(switches):
     return switches, r2_fe
 
 
-def step2_random_forest(switches, skills):
+def step2_random_forest(switches, skills, skills_np, occ_lookup,
+                        do_cv=False, cv_n_estimators=50, model="rf"):
     """
     Step 2: Random Forest to predict residual switching from skill data.
     Features: skill vectors of origin, destination, and their differences.
     Target: OLS residuals from Step 1.
     Predicted value = Skill Portability measure.
+
+    skills_np/occ_lookup are the float32 skill array and code -> row
+    table from build_switching_regression_data.
+
+    do_cv runs a 5-fold cross-validation diagnostic first, using a
+    smaller forest of cv_n_estimators trees per fold.
+
+    model="hgb" swaps the forest for histogram-based gradient boosting
+    (much faster on large N); its importances are permutation-based.
     """
-    print("\nStep 2: Random Forest on skill vectors...")
+    model_name = "Gradient Boosting" if model == "hgb" else "Random Forest"
+    print(f"\nStep 2: {model_name} on skill vectors...")
 
     # Build feature matrix
     skill_cols = skills.columns.tolist()
@@ -148,13 +244,20 @@ def step2_random_forest(switches, skills):
     origins = switches["occ_origin"].values
     dests = switches["occ_dest"].values
 
-    # Get skill vectors
-    origin_skills = skills.loc[origins].values
-    dest_skills = skills.loc[dests].values
-    diff_skills = origin_skills - dest_skills
+    # Get skill vectors by row position (float32: trees split on float32 anyway)
+    origin_rows = occ_lookup[origins]
+    dest_rows = occ_lookup[dests]
 
-    X = np.hstack([origin_skills, dest_skills, diff_skills])
-    y = switches["residual"].values
+    # Fill the feature matrix in place rather than stacking temporaries
+    p = skills_np.shape[1]
+    X = np.empty((len(origins), 3 * p), dtype=np.float32)
+    X[:, :p] = skills_np[origin_rows]
+    X[:, p:2 * p] = skills_np[dest_rows]
+    np.subtract(X[:, :p], X[:, p:2 * p], out=X[:, 2 * p:])
+
+    # X is already the C-contiguous float32 sklearn's trees use internally.
+    # The target stays float64: tree criteria cast y to float64 anyway.
+    y = switches["residual"].to_numpy(dtype=np.float64)
 
     feature_names = (
         [f"origin_{c}" for c in skill_cols] +
@@ -165,41 +268,66 @@ def step2_random_forest(switches, skills):
     print(f"  Feature matrix: {X.shape}")
     print(f"  Target (residuals): {len(y)}")
 
-    # Train Random Forest
-    rf = RandomForestRegressor(
-        n_estimators=200,
-        max_depth=20,
-        min_samples_leaf=10,
-        max_features="sqrt",
-        n_jobs=-1,
-        random_state=42
-    )
-
-    # Cross-validation score
-    print("  Running 5-fold cross-validation...")
-    cv_scores = cross_val_score(rf, X, y, cv=5, scoring="r2")
-    print(f"  CV R² scores: {cv_scores}")
-    print(f"  Mean CV R²: {cv_scores.mean():.4f} (+/- {cv_scores.std():.4f})")
+    # Train Random Forest (or histogram gradient boosting)
+    if model == "hgb":
+        est = HistGradientBoostingRegressor(
+            max_iter=400,
+            max_depth=8,
+            learning_rate=0.05,
+            early_stopping=True,
+            random_state=42
+        )
+    else:
+        est = RandomForestRegressor(
+            n_estimators=200,
+            max_depth=20,
+            min_samples_leaf=10,
+            max_features="sqrt",
+            bootstrap=True,
+            max_samples=0.3,  # each tree sees a 30% bootstrap draw of the pairs
+            n_jobs=-1,
+            random_state=42
+        )
+
+    # Cross-validation score (diagnostic only; doesn't affect the fit below)
+    if do_cv:
+        est_cv = clone(est)
+        if model == "hgb":
+            print("  Running 5-fold cross-validation...")
+        else:
+            print(f"  Running 5-fold cross-validation ({cv_n_estimators} trees)...")
+            est_cv.set_params(n_estimators=cv_n_estimators)
+        cv_scores = cross_val_score(est_cv, X, y, cv=5, scoring="r2")
+        print(f"  CV R² scores: {cv_scores}")
+        print(f"  Mean CV R²: {cv_scores.mean():.4f} (+/- {cv_scores.std():.4f})")
 
     # Fit on full data
     print("  Fitting full model...")
-    rf.fit(X, y)
+    est.fit(X, y)
 
     # In-sample predictions = skill portability measure
-    switches = switches.copy()
-    switches["predicted_skill_portability"] = rf.predict(X)
+    switches["predicted_skill_portability"] = est.predict(X)
 
     # Training R²
-    train_r2 = rf.score(X, y)
+    train_r2 = est.score(X, y)
     print(f"  Training R²: {train_r2:.4f}")
 
     # Feature importance (top 20)
-    importances = pd.Series(rf.feature_importances_, index=feature_names)
+    if model == "hgb":
+        # Boosting has no impurity importances; permute on a subsample
+        rng = np.random.default_rng(42)
+        sample = rng.choice(len(y), size=min(len(y), 10000), replace=False)
+        perm = permutation_importance(
+            est, X[sample], y[sample], n_repeats=3, n_jobs=-1, random_state=42
+        )
+        importances = pd.Series(perm.importances_mean, index=feature_names)
+    else:
+        importances = pd.Series(est.feature_importances_, index=feature_names)
     print("\n  Top 20 most important features:")
     for feat, imp in importances.nlargest(20).items():
         print(f"    {feat}: {imp:.4f}")
 
-    return switches, rf, importances
+    return switches, est, importances
 
 
 def compute_aggregate_portability(switches, skills):
@@ -211,42 +339,34 @@ def compute_aggregate_portability(switches, skills):
     print("\nComputing aggregate skill portability by occupation...")
 
     # Load employment data
-    emp = pd.read_csv(os.path.join(PROC_DIR, "cps_employment_changes.csv"))
+    emp = pd.read_parquet(
+        os.path.join(PROC_DIR, "cps_employment_changes.parquet"), columns=["occ", "emp_pre"]
+    )
     emp_map = dict(zip(emp["occ"].astype(int), emp["emp_pre"]))
 
     # Normalize portability to [0, 1]
     port = switches[["occ_origin", "occ_dest", "predicted_skill_portability"]].copy()
-    port["portability_norm"] = (
-        (port["predicted_skill_portability"] - port["predicted_skill_portability"].min()) /
-        (port["predicted_skill_portability"].max() - port["predicted_skill_portability"].min())
-    )
+    pred = port["predicted_skill_portability"]
+    pmin, pmax = pred.min(), pred.max()
+    port["portability_norm"] = (pred - pmin) / (pmax - pmin)
 
     # For each origin occupation, compute weighted portability
-    agg_port = {}
-    for occ_o, group in port.groupby("occ_origin"):
-        weighted_port = 0
-        total_weight = 0
-        for _, row in group.iterrows():
-            occ_d = row["occ_dest"]
-            emp_d = emp_map.get(int(occ_d), 0)
-            weighted_port += row["portability_norm"] * emp_d
-            total_weight += emp_d
-
-        if total_weight > 0:
-            agg_port[int(occ_o)] = weighted_port / total_weight
+    # (and the simpler mean pairwise portability) in a single groupby
+    port["emp_d"] = port["occ_dest"].astype(int).map(emp_map).fillna(0)
+    port["wp"] = port["portability_norm"] * port["emp_d"]
+    sums = port.groupby("occ_origin").agg(
+        wp=("wp", "sum"),
+        emp_d=("emp_d", "sum"),
+        mean_pairwise_portability=("portability_norm", "mean"),
+    )
+    sums = sums[sums["emp_d"] > 0]
 
     agg_df = pd.DataFrame({
-        "occ2010": list(agg_port.keys()),
-        "aggregate_portability": list(agg_port.values())
+        "occ2010": sums.index.astype(int),
+        "aggregate_portability": (sums["wp"] / sums["emp_d"]).to_numpy(),
+        "mean_pairwise_portability": sums["mean_pairwise_portability"].to_numpy()
     })
 
-    # Also compute simpler version: mean pairwise portability
-    mean_port = port.groupby("occ_origin")["portability_norm"].mean().reset_index()
-    mean_port.columns = ["occ2010", "mean_pairwise_portability"]
-    mean_port["occ2010"] = mean_port["occ2010"].astype(int)
-
-    agg_df = agg_df.merge(mean_port, on="occ2010", how="left")
-
     # Add titles
     titles = pd.read_csv(os.path.join(PROC_DIR, "occ2010_titles.csv"))
     agg_df = agg_df.merge(titles, on="occ2010", how="left")
@@ -267,18 +387,41 @@ def compute_aggregate_portability(switches, skills):
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Skill portability model (Khachiyan 2021 replication)"
+    )
+    parser.add_argument(
+        "--cv", action="store_true",
+        help="run 5-fold cross-validation of the random forest (diagnostic)"
+    )
+    parser.add_argument(
+        "--fe-solver", choices=["lsmr", "map"], default="lsmr",
+        help="step 1 FE solver: sparse least squares (default) or iterative demeaning"
+    )
+    parser.add_argument(
+        "--model", choices=["rf", "hgb"], default="rf",
+        help="step 2 model: random forest (default) or histogram gradient boosting"
+    )
+    parser.add_argument(
+        "--csv", action="store_true",
+        help="also write CSV copies of the portability outputs (Parquet is always written)"
+    )
+    args = parser.parse_args()
+
     print("=" * 60)
     print("SKILL PORTABILITY MODEL (Khachiyan 2021 replication)")
     print("=" * 60)
 
     # Build regression data
-    switches, skills = build_switching_regression_data()
+    switches, skills, skills_np, occ_lookup = build_switching_regression_data()
 
     # Step 1: OLS residualization
-    switches, r2_fe = step1_ols_residualize(switches)
+    switches, r2_fe = step1_ols_residualize(switches, method=args.fe_solver)
 
-    # Step 2: Random Forest
-    switches, rf_model, importances = step2_random_forest(switches, skills)
+    # Step 2: Random Forest (or gradient boosting)
+    switches, est, importances = step2_random_forest(
+        switches, skills, skills_np, occ_lookup, do_cv=args.cv, model=args.model
+    )
 
     # Aggregate portability
     agg_df, pairwise_port = compute_aggregate_portability(switches, skills)
@@ -286,21 +429,34 @@ def main():
     # Save outputs
     print("\nSaving outputs...")
 
-    # Pairwise portability
+    # Pairwise portability (with the [0, 1]-normalized measure, so
+    # downstream scripts don't have to renormalize)
     pairwise_out = switches[
         ["occ_origin", "occ_dest", "log_switch_share", "residual",
          "predicted_skill_portability"]
-    ].copy()
-    pairwise_out.to_csv(os.path.join(PROC_DIR, "pairwise_skill_portability.csv"), index=False)
+    ].assign(portability_norm=pairwise_port["portability_norm"])
+    pairwise_out.to_parquet(
+        os.path.join(PROC_DIR, "pairwise_skill_portability.parquet"), index=False, compression="zstd"
+    )
 
     # Aggregate portability
-    agg_df.to_csv(os.path.join(PROC_DIR, "aggregate_skill_portability.csv"), index=False)
-
-    # Feature importances
-    importances.sort_values(ascending=False).to_csv(
-        os.path.join(OUT_DIR, "rf_feature_importances.csv")
+    agg_df.to_parquet(
+        os.path.join(PROC_DIR, "aggregate_skill_portability.parquet"), index=False, compression="zstd"
     )
 
+    if args.csv:
+        pairwise_out.to_csv(os.path.join(PROC_DIR, "pairwise_skill_portability.csv"), index=False)
+        agg_df.to_csv(os.path.join(PROC_DIR, "aggregate_skill_portability.csv"), index=False)
+
+    # Feature importances, tagged with how they were computed so the
+    # figures can label them (permutation importances can be negative)
+    importances.sort_values(ascending=False).rename_axis("feature").reset_index(
+        name="importance"
+    ).assign(
+        model=args.model,
+        importance_type="permutation" if args.model == "hgb" else "impurity",
+    ).to_csv(os.path.join(OUT_DIR, "feature_importances.csv"), index=False)
+
     print(f"\nDone!")
     print(f"  Pairwise portability: {len(pairwise_out):,} directional pairs")
     print(f"  Aggregate portability: {len(agg_df)} occupations")
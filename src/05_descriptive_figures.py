@@ -5,10 +5,12 @@ Generate descriptive figures for the capstone paper.
 
 import pandas as pd
 import numpy as np
+import matplotlib
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 import seaborn as sns
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 PROC_DIR = os.path.expanduser("~/Downloads/capstone/data/processed")
 FIG_DIR = os.path.expanduser("~/Downloads/capstone/output/figures")
@@ -23,9 +25,21 @@ plt.rcParams.update({
 })
 
 
+def _linfit(x, y):
+    """Closed-form simple OLS; returns (slope, intercept)."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    xm, ym = x.mean(), y.mean()
+    slope = ((x - xm) * (y - ym)).sum() / ((x - xm) ** 2).sum()
+    return slope, ym - slope * xm
+
+
 def fig1_portability_distribution():
     """Distribution of aggregate skill portability across occupations."""
-    port = pd.read_csv(os.path.join(PROC_DIR, "aggregate_skill_portability.csv"))
+    port = pd.read_parquet(
+        os.path.join(PROC_DIR, "aggregate_skill_portability.parquet"),
+        columns=["aggregate_portability"]
+    )
 
     fig, ax = plt.subplots()
     ax.hist(port["aggregate_portability"], bins=40, color="#2196F3",
@@ -44,16 +58,14 @@ def fig1_portability_distribution():
 
 def fig2_pairwise_distribution():
     """Distribution of pairwise skill portability (predicted measure)."""
-    pw = pd.read_csv(os.path.join(PROC_DIR, "pairwise_skill_portability.csv"))
-
-    # Normalize to [0,1]
-    pw["port_norm"] = (
-        (pw["predicted_skill_portability"] - pw["predicted_skill_portability"].min()) /
-        (pw["predicted_skill_portability"].max() - pw["predicted_skill_portability"].min())
+    # Already normalized to [0,1] by 04_skill_portability.py
+    pw = pd.read_parquet(
+        os.path.join(PROC_DIR, "pairwise_skill_portability.parquet"),
+        columns=["portability_norm"]
     )
 
     fig, ax = plt.subplots()
-    ax.hist(pw["port_norm"], bins=80, color="#4CAF50", edgecolor="white",
+    ax.hist(pw["portability_norm"], bins=80, color="#4CAF50", edgecolor="white",
             alpha=0.85, density=True)
     ax.set_xlabel("Pairwise Skill Portability (Normalized)")
     ax.set_ylabel("Density")
@@ -66,7 +78,10 @@ def fig2_pairwise_distribution():
 
 def fig3_top_bottom_occupations():
     """Bar chart of top/bottom 15 occupations by portability."""
-    port = pd.read_csv(os.path.join(PROC_DIR, "aggregate_skill_portability.csv"))
+    port = pd.read_parquet(
+        os.path.join(PROC_DIR, "aggregate_skill_portability.parquet"),
+        columns=["title", "aggregate_portability"]
+    )
     port["title_short"] = port["title"].str[:45]
 
     top = port.nlargest(15, "aggregate_portability")
@@ -102,7 +117,10 @@ def fig3_top_bottom_occupations():
 
 def fig4_employment_changes():
     """Pre/post 2022 employment changes distribution."""
-    emp = pd.read_csv(os.path.join(PROC_DIR, "cps_employment_changes.csv"))
+    emp = pd.read_parquet(
+        os.path.join(PROC_DIR, "cps_employment_changes.parquet"),
+        columns=["emp_pct_change_no_covid"]
+    )
 
     fig, ax = plt.subplots()
     emp_clean = emp["emp_pct_change_no_covid"].dropna()
@@ -124,8 +142,14 @@ def fig4_employment_changes():
 
 def fig5_portability_vs_employment():
     """Scatter: skill portability vs employment change (preview of main result)."""
-    port = pd.read_csv(os.path.join(PROC_DIR, "aggregate_skill_portability.csv"))
-    emp = pd.read_csv(os.path.join(PROC_DIR, "cps_employment_changes.csv"))
+    port = pd.read_parquet(
+        os.path.join(PROC_DIR, "aggregate_skill_portability.parquet"),
+        columns=["occ2010", "aggregate_portability"]
+    )
+    emp = pd.read_parquet(
+        os.path.join(PROC_DIR, "cps_employment_changes.parquet"),
+        columns=["occ", "emp_pre", "emp_pct_change_no_covid"]
+    )
     emp["occ"] = emp["occ"].astype(int)
 
     merged = port.merge(emp, left_on="occ2010", right_on="occ", how="inner")
@@ -140,12 +164,11 @@ def fig5_portability_vs_employment():
     )
 
     # Add trend line
-    z = np.polyfit(merged["aggregate_portability"],
-                   merged["emp_pct_change_no_covid"], 1)
-    p = np.poly1d(z)
+    slope, intercept = _linfit(merged["aggregate_portability"],
+                               merged["emp_pct_change_no_covid"])
     x_range = np.linspace(merged["aggregate_portability"].min(),
                           merged["aggregate_portability"].max(), 100)
-    ax.plot(x_range, p(x_range), "r--", linewidth=2, alpha=0.7)
+    ax.plot(x_range, slope * x_range + intercept, "r--", linewidth=2, alpha=0.7)
 
     corr = merged["aggregate_portability"].corr(merged["emp_pct_change_no_covid"])
     ax.text(0.05, 0.95, f"Corr: {corr:.3f}", transform=ax.transAxes,
@@ -162,13 +185,22 @@ def fig5_portability_vs_employment():
     print("  Saved fig5_portability_vs_employment.png")
 
 
+# Axis label and title suffix for each importance type written by 04
+IMPORTANCE_LABELS = {
+    "impurity": ("Feature Importance (Increase in Node Purity)",
+                 "Random Forest Feature Importance"),
+    "permutation": ("Permutation Importance (Mean Decrease in R²)",
+                    "Gradient Boosting Permutation Importance"),
+}
+
+
 def fig6_feature_importances():
-    """Top RF feature importances."""
+    """Top step-2 feature importances (impurity or permutation)."""
     imp = pd.read_csv(
-        os.path.expanduser("~/Downloads/capstone/output/rf_feature_importances.csv"),
-        index_col=0, header=None
+        os.path.expanduser("~/Downloads/capstone/output/feature_importances.csv"),
+        index_col="feature"
     )
-    imp.columns = ["importance"]
+    xlabel, title = IMPORTANCE_LABELS[imp["importance_type"].iloc[0]]
     imp = imp.nlargest(25, "importance")
 
     # Clean names
@@ -179,8 +211,9 @@ def fig6_feature_importances():
             edgecolor="white")
     ax.set_yticks(range(len(imp)))
     ax.set_yticklabels(imp.index, fontsize=9)
-    ax.set_xlabel("Feature Importance (Increase in Node Purity)")
-    ax.set_title("Top 25 Skill Dimensions Driving Portability\n(Random Forest Feature Importance)")
+    ax.axvline(0, color="black", linewidth=0.5)
+    ax.set_xlabel(xlabel)
+    ax.set_title(f"Top 25 Skill Dimensions Driving Portability\n({title})")
     ax.invert_yaxis()
     fig.tight_layout()
     fig.savefig(os.path.join(FIG_DIR, "fig6_feature_importances.png"))
@@ -190,12 +223,21 @@ def fig6_feature_importances():
 
 def main():
     print("Generating descriptive figures...\n")
-    fig1_portability_distribution()
-    fig2_pairwise_distribution()
-    fig3_top_bottom_occupations()
-    fig4_employment_changes()
-    fig5_portability_vs_employment()
-    fig6_feature_importances()
+    figures = [
+        fig1_portability_distribution,
+        fig2_pairwise_distribution,
+        fig3_top_bottom_occupations,
+        fig4_employment_changes,
+        fig5_portability_vs_employment,
+        fig6_feature_importances,
+    ]
+    # Figures share no state, so render them in parallel
+    # Workers render headless; the importing process keeps its own backend
+    with ProcessPoolExecutor(max_workers=min(len(figures), os.cpu_count() or 1),
+                             initializer=matplotlib.use, initargs=("Agg",)) as ex:
+        futures = [ex.submit(f) for f in figures]
+        for fut in futures:
+            fut.result()  # re-raise any worker error
     print(f"\nAll figures saved to {FIG_DIR}")
 
 
@@ -21,69 +21,68 @@ For now (without AI index): run portability-only regressions + prepare framework
 import pandas as pd
 import numpy as np
 import statsmodels.api as sm
-import statsmodels.formula.api as smf
+import argparse
 import os
 
 PROC_DIR = os.path.expanduser("~/Downloads/capstone/data/processed")
 OUT_DIR = os.path.expanduser("~/Downloads/capstone/output/tables")
 os.makedirs(OUT_DIR, exist_ok=True)
 
+# Broad occupation categories by OCC2010 code range: codes below
+# OCC_CATEGORY_BOUNDS[i] (and at or above the previous bound) get
+# OCC_CATEGORY_LABELS[i]; codes at or above the last bound are Military/Other
+OCC_CATEGORY_BOUNDS = np.array([
+    500, 1000, 2000, 3000, 3600, 4000, 4200, 4700,
+    5000, 6000, 6200, 6800, 7000, 7700, 9000, 9800,
+])
+OCC_CATEGORY_LABELS = np.array([
+    "Management/Business", "Financial/Math/Science", "Computer/Engineering",
+    "Education/Legal/Social", "Healthcare Practitioners", "Healthcare Support",
+    "Protective Services", "Food/Personal Services", "Sales",
+    "Office/Administrative", "Farming/Fishing", "Construction", "Extraction",
+    "Installation/Maintenance", "Production", "Transportation", "Military/Other",
+])
+
 
 def build_analysis_dataset():
     """Merge all data sources into analysis-ready dataset."""
     print("Building analysis dataset...")
 
     # Skill portability
-    port = pd.read_csv(os.path.join(PROC_DIR, "aggregate_skill_portability.csv"))
-    port = port[["occ2010", "aggregate_portability", "mean_pairwise_portability", "title"]].copy()
+    port = pd.read_parquet(
+        os.path.join(PROC_DIR, "aggregate_skill_portability.parquet"),
+        columns=["occ2010", "aggregate_portability", "mean_pairwise_portability", "title"]
+    )
 
     # Employment changes
-    emp = pd.read_csv(os.path.join(PROC_DIR, "cps_employment_changes.csv"))
+    emp = pd.read_parquet(os.path.join(PROC_DIR, "cps_employment_changes.parquet"))
     emp["occ"] = emp["occ"].astype(int)
 
     # Annual employment for controls
-    ann_emp = pd.read_csv(os.path.join(PROC_DIR, "cps_annual_employment.csv"))
-
-    # Compute pre-period size (log employment) as control
-    pre_size = ann_emp[ann_emp["year"].between(2018, 2021)].groupby("occ").agg(
-        avg_emp=("avg_monthly_employment", "mean")
-    ).reset_index()
-    pre_size["log_emp_pre"] = np.log(pre_size["avg_emp"])
-    pre_size["occ"] = pre_size["occ"].astype(int)
-
-    # Compute pre-trend (2018-2021 employment growth) as control
-    emp_2018 = ann_emp[ann_emp["year"] == 2018].set_index("occ")["avg_monthly_employment"]
-    emp_2021 = ann_emp[ann_emp["year"] == 2021].set_index("occ")["avg_monthly_employment"]
-    pre_trend = ((emp_2021 - emp_2018) / emp_2018 * 100).reset_index()
-    pre_trend.columns = ["occ", "pre_trend_pct"]
-    pre_trend["occ"] = pre_trend["occ"].astype(int)
+    ann_emp = pd.read_parquet(
+        os.path.join(PROC_DIR, "cps_annual_employment.parquet"),
+        columns=["year", "occ", "avg_monthly_employment"]
+    )
+
+    # Pre-period controls from one occ x year pivot: size (log of the
+    # 2018-2021 average employment) and pre-trend (2018-2021 growth)
+    piv = ann_emp[ann_emp["year"].between(2018, 2021)].pivot_table(
+        index="occ", columns="year", values="avg_monthly_employment"
+    ).reindex(columns=range(2018, 2022))
+    controls = pd.DataFrame({
+        "occ": piv.index.astype(int),
+        "log_emp_pre": np.log(piv.mean(axis=1).to_numpy()),
+        "pre_trend_pct": ((piv[2021] - piv[2018]) / piv[2018] * 100).to_numpy(),
+    })
 
     # Merge
     df = port.merge(emp, left_on="occ2010", right_on="occ", how="inner")
-    df = df.merge(pre_size[["occ", "log_emp_pre"]], on="occ", how="left")
-    df = df.merge(pre_trend, on="occ", how="left")
-
-    # Add broad occupation category (from OCC2010 first digit)
-    def occ_category(code):
-        if code < 500: return "Management/Business"
-        elif code < 1000: return "Financial/Math/Science"
-        elif code < 2000: return "Computer/Engineering"
-        elif code < 3000: return "Education/Legal/Social"
-        elif code < 3600: return "Healthcare Practitioners"
-        elif code < 4000: return "Healthcare Support"
-        elif code < 4200: return "Protective Services"
-        elif code < 4700: return "Food/Personal Services"
-        elif code < 5000: return "Sales"
-        elif code < 6000: return "Office/Administrative"
-        elif code < 6200: return "Farming/Fishing"
-        elif code < 6800: return "Construction"
-        elif code < 7000: return "Extraction"
-        elif code < 7700: return "Installation/Maintenance"
-        elif code < 9000: return "Production"
-        elif code < 9800: return "Transportation"
-        else: return "Military/Other"
-
-    df["occ_category"] = df["occ2010"].apply(occ_category)
+    df = df.merge(controls, on="occ", how="left")
+
+    # Add broad occupation category (from OCC2010 code range)
+    df["occ_category"] = OCC_CATEGORY_LABELS[
+        np.searchsorted(OCC_CATEGORY_BOUNDS, df["occ2010"].to_numpy(), side="right")
+    ]
 
     # Standardize key variables
     df["port_std"] = (df["aggregate_portability"] - df["aggregate_portability"].mean()) / df["aggregate_portability"].std()
@@ -110,29 +109,42 @@ def run_preliminary_regressions(df):
 
     results = {}
 
+    # Build the design matrix once and slice it per model; missing="drop"
+    # keeps each model's estimation sample the same as the formula API
+    y = df["emp_change"]
+    cat_fe = pd.get_dummies(df["occ_category"], prefix="occ_category",
+                            drop_first=True, dtype=float)
+    X_full = pd.concat(
+        [df[["port_std", "log_emp_pre", "pre_trend_pct"]], cat_fe], axis=1
+    )
+    X_full.insert(0, "Intercept", 1.0)
+    base_cols = ["Intercept", "port_std", "log_emp_pre", "pre_trend_pct"]
+
+    # m3 and m4 share the complete-case sample; subset it once
+    complete = X_full.notna().all(axis=1) & y.notna()
+    y_cc, X_cc = y[complete], X_full[complete]
+
     # (1) Bivariate: employment change ~ portability
     print("\n--- Model 1: Bivariate ---")
-    m1 = smf.ols("emp_change ~ port_std", data=df).fit()
+    m1 = sm.OLS(y, X_full[base_cols[:2]], missing="drop").fit()
     print(m1.summary2().tables[1].to_string())
     results["m1"] = m1
 
     # (2) With size control
     print("\n--- Model 2: + Log Employment ---")
-    m2 = smf.ols("emp_change ~ port_std + log_emp_pre", data=df).fit()
+    m2 = sm.OLS(y, X_full[base_cols[:3]], missing="drop").fit()
     print(m2.summary2().tables[1].to_string())
     results["m2"] = m2
 
     # (3) With pre-trend control
     print("\n--- Model 3: + Pre-trend ---")
-    m3 = smf.ols("emp_change ~ port_std + log_emp_pre + pre_trend_pct",
-                  data=df.dropna(subset=["pre_trend_pct"])).fit()
+    m3 = sm.OLS(y_cc, X_cc[base_cols]).fit()
     print(m3.summary2().tables[1].to_string())
     results["m3"] = m3
 
     # (4) With occupation category FE
     print("\n--- Model 4: + Occupation Category FE ---")
-    m4 = smf.ols("emp_change ~ port_std + log_emp_pre + pre_trend_pct + C(occ_category)",
-                  data=df.dropna(subset=["pre_trend_pct"])).fit()
+    m4 = sm.OLS(y_cc, X_cc).fit()
     # Print just key coefficients
     key_vars = ["Intercept", "port_std", "log_emp_pre", "pre_trend_pct"]
     coef_table = m4.summary2().tables[1]
@@ -225,6 +237,15 @@ def show_template_specification():
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Preliminary portability regressions"
+    )
+    parser.add_argument(
+        "--csv", action="store_true",
+        help="also write a CSV copy of the analysis dataset (Parquet is always written)"
+    )
+    args = parser.parse_args()
+
     df = build_analysis_dataset()
     results = run_preliminary_regressions(df)
 
@@ -236,7 +257,11 @@ def main():
 
     # Save
     table.to_csv(os.path.join(OUT_DIR, "table1_preliminary_regressions.csv"), index=False)
-    df.to_csv(os.path.join(PROC_DIR, "analysis_dataset.csv"), index=False)
+    df.to_parquet(
+        os.path.join(PROC_DIR, "analysis_dataset.parquet"), index=False, compression="zstd"
+    )
+    if args.csv:
+        df.to_csv(os.path.join(PROC_DIR, "analysis_dataset.csv"), index=False)
 
     show_template_specification()
 